@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 import binascii
 import os
-import struct
 import sys
 from argparse import ArgumentParser
 
@@ -105,19 +104,12 @@ def main(titleid, titlever=None, pack_as_wad=True, decryptcontents=False, localu
         cetk = WADGEN.Ticket(tickettemplate)
         cetk.hdr.titleid = tmd.hdr.titleid
         cetk.hdr.titleversion = tmd.hdr.titleversion
-        cetk.hdr.titlekey = binascii.a2b_hex(enc_titlekey)
+        cetk.set_titlekey(enc_titlekey)
         if tmd.get_region() == "Korea" and not tmd.get_titleid().startswith("00030"):  # Korea + not DSi
             cetk.hdr.ckeyindex = 1  # Korean common-key index
         elif titleid.startswith("00000007") or titleid.startswith("0007"):  # Wii U Wii Mode
             cetk.hdr.ckeyindex = 2  # vWii common-key index
         cetk.dump(os.path.join(titlepath, "cetk"))
-        if localuse:  # We need to set Title IV and decrypt the titlekey for verifying
-            cetk.titleiv = struct.pack(">Q", cetk.hdr.titleid) + b"\x00" * 8
-            cetk.decrypted_titlekey = utils.Crypto.decrypt_titlekey(
-                commonkey=cetk.get_decryption_key(),
-                iv=cetk.titleiv,
-                titlekey=cetk.hdr.titlekey
-            )
 
         if onlyticket:
             print("Finished.")
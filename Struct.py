@@ -18,6 +18,10 @@ class StructException(Exception):
     pass
 
 
+# Baked field layout and default values of every flat Struct subclass, built on first instantiation
+_layouts = {}
+
+
 class Struct:
     __slots__ = ('__attrs__', '__baked__', '__defs__', '__next__', '__sizes__', '__values__')
     int8 = StructType(('b', 1))
@@ -51,7 +55,15 @@ class Struct:
         self.__baked__ = False
 
         if not func:
-            self.__format__()
+            layout = _layouts.get(self.__class__)
+            if layout:
+                self.__defs__, self.__sizes__, self.__attrs__, defaults = layout
+                self.__values__ = dict(defaults)
+            else:
+                self.__format__()
+                # Only flat layouts are shared, nested structs and arrays need fresh defaults per instance
+                if not any(isinstance(value, (Struct, list)) for value in self.__values__.values()):
+                    _layouts[self.__class__] = (self.__defs__, self.__sizes__, self.__attrs__, dict(self.__values__))
         else:
             sys.settrace(self.__trace__)
             func()
@@ -188,7 +200,7 @@ class Struct:
                 if isinstance(size, str):
                     size = self.__values__[size] + offset
 
-                temp = data[pos:pos + size]
+                temp = bytes(data[pos:pos + size])  # Copy out of memoryviews, no-op for bytes
                 if len(temp) != size:
                     raise StructException('Expected %i byte string, got %i' % (size, len(temp)))
 
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import binascii
+import hashlib
 import os
 import struct
 
@@ -8,7 +9,7 @@ from Crypto.Signature import PKCS1_v1_5
 from requests import get, HTTPError
 
 import utils
-from Struct import Struct
+from Struct import Struct, StructException
 from utils import CachedProperty
 
 DECRYPTION_KEYS = [
@@ -18,6 +19,33 @@ DECRYPTION_KEYS = [
 ]
 DSI_KEY = b"\xAF\x1B\xF5\x16\xA8\x07\xD2\x1A\xEA\x45\x98\x4F\x04\x74\x28\x61"  # DSi Key
 
+# DSi Title IDs start with 00030
+_DSI_MASK = 0xFFFFF00000000000
+_DSI_PREFIX = 0x0003000000000000
+
+_PADDING = struct.Struct(">H")
+
+
+def _fakesign_search(data, offset):
+    """Returns the 2-byte padding value that makes the SHA1 hash of data start with 00.
+       The padding is written to data (a bytearray) at offset. Returns None if no value works.
+    """
+    # Everything before the padding never changes, so hash it once and only feed the rest per attempt
+    prefix_sha1 = hashlib.sha1(data[:offset])
+    suffix = memoryview(data)[offset:]
+
+    # Bind the per-attempt calls locally to keep the search loop free of lookups
+    copy_prefix = prefix_sha1.copy
+    set_padding = _PADDING.pack_into
+
+    for i in range(65535):  # Max value for unsigned short integer (2 bytes)
+        set_padding(data, offset, i)
+        sha1 = copy_prefix()
+        sha1.update(suffix)
+        if sha1.digest()[0] == 0:
+            return i
+    return None
+
 
 class Signature:
     """Represents the Signature
@@ -137,14 +165,21 @@ class Certificate:
             filebytes[len(self.signature) + len(self.certificate):
                       len(self.signature) + len(self.certificate) + pubkey_length]
         )
-        if pubkey_length != 0x3C + 0x3C:
-            self.pubkey = construct(
-                (int.from_bytes(self.pubkey_struct.modulus, byteorder="big"), self.pubkey_struct.exponent)
-            )
-            self.signer = PKCS1_v1_5.new(self.pubkey)
-        else:
-            self.pubkey = None
-            self.signer = None
+
+    @CachedProperty
+    def pubkey(self):
+        """RSA public key (None for ECC), only built once a signature is verified."""
+        if isinstance(self.pubkey_struct, self.PubKeyECC):
+            return None
+        return construct(
+            (int.from_bytes(self.pubkey_struct.modulus, byteorder="big"), self.pubkey_struct.exponent)
+        )
+
+    @CachedProperty
+    def signer(self):
+        if self.pubkey is None:
+            return None
+        return PKCS1_v1_5.new(self.pubkey)
 
     def __len__(self):
         return len(self.signature) + len(self.certificate) + len(self.pubkey_struct)
@@ -237,6 +272,8 @@ if os.path.isfile("root-key"):
 else:
     ROOT_KEY = None
 
+_TMD_PADDING_OFFSET = 0xA2  # Offset of the padding2 field in the header
+
 
 class TMD:
     """Represents the Title Metadata
@@ -392,7 +429,7 @@ class TMD:
 
     def get_type(self):
         # https://dsibrew.org/wiki/Title_list#System_Codes
-        if self.get_titleid().startswith("00030"):  # DSi
+        if (self.hdr.titleid & _DSI_MASK) == _DSI_PREFIX:  # DSi
             types = {
                 "4B": "DSiWare",
                 "48": "DSi System / Channel"
@@ -418,7 +455,7 @@ class TMD:
                 return "Unknown"
 
     def get_region(self):
-        if self.get_titleid().startswith("00030"):  # DSi
+        if (self.hdr.titleid & _DSI_MASK) == _DSI_PREFIX:  # DSi
             # https://dsibrew.org/wiki/Title_list#Region_Codes
             regions = {
                 "41": "Free",
@@ -478,19 +515,11 @@ class TMD:
         sigsize = len(self.signature.signature.data)
         self.signature.signature.data = b"\x00" * sigsize
 
-        # Modify content until SHA1 hash starts with 00
-        for i in range(65535):  # Max value for unsigned short integer (2 bytes)
-            # Modify tmd padding2
-            self.hdr.padding2 = i
-
-            # Calculate hash
-            sha1hash = utils.Crypto.create_sha1hash_hex(self.signature_pack())
-
-            # Found valid hash!
-            if sha1hash.startswith("00"):
-                return
-
-        raise Exception("Fakesigning failed.")
+        # Modify tmd padding2 until SHA1 hash starts with 00
+        padding = _fakesign_search(bytearray(self.signature_pack()), _TMD_PADDING_OFFSET)
+        if padding is None:
+            raise Exception("Fakesigning failed.")
+        self.hdr.padding2 = padding
 
     def pack(self):
         """Returns TMD WITHOUT certificates."""
@@ -646,6 +675,16 @@ class TMD:
         return output
 
 
+# The Ticket header is one fixed-size record, so it is parsed with a single precompiled struct
+_TICKET_HEADER = struct.Struct(">64s60s3s16sBQLQHHLLBB48s64sH64s")
+_TICKET_HEADER_FIELDS = (
+    "issuer", "ecdhdata", "unused1", "titlekey", "unknown1", "ticketid", "consoleid", "titleid", "unknown2",
+    "titleversion", "permitted_titles_mask", "permit_mask", "export_allowed", "ckeyindex", "unknown3",
+    "content_access_permissions", "padding", "limits"
+)
+_TICKET_PADDING_OFFSET = 0x122  # Offset of the padding field in the header
+
+
 class Ticket:
     """Represents the Ticket
        Reference: https://wiibrew.org/wiki/Ticket
@@ -653,6 +692,11 @@ class Ticket:
     Args:
         file (Union[str, bytes]): Path to Ticket or a Ticket bytes-object
     """
+    __slots__ = (
+        "signature", "hdr", "certificates", "_cert_index", "_cert_index_certs", "_titleiv", "_titleiv_titleid",
+        "_issuers", "_issuers_issuer", "_decryption_key", "_decryption_key_sig", "_decrypted_titlekey",
+        "_decrypted_titlekey_sig"
+    )
 
     class TicketHeader(Struct):
         __endian__ = Struct.BE
@@ -677,25 +721,57 @@ class Ticket:
             self.padding = Struct.uint16
             self.limits = Struct.string(0x40)
 
+        def unpack(self, data, pos=0):
+            try:
+                values = _TICKET_HEADER.unpack_from(data, pos)
+            except struct.error as e:
+                raise StructException(str(e))
+            self.__values__.update(zip(_TICKET_HEADER_FIELDS, values))
+            return self
+
+        def pack(self):
+            return _TICKET_HEADER.pack(*[self.__values__[name] for name in _TICKET_HEADER_FIELDS])
+
+        def __len__(self):
+            return _TICKET_HEADER.size
+
     def __init__(self, file):
         if isinstance(file, str):
             try:
                 file = open(file, 'rb').read()
             except FileNotFoundError:
                 raise FileNotFoundError('File not found')
+        file = memoryview(file)  # Signature, header and certificates are all read without copying the ticket
 
         # Signature
         self.signature = Signature(file)
         pos = len(self.signature)
 
         # Header
-        self.hdr = self.TicketHeader().unpack(file[pos:pos + 0x210])
+        self.hdr = self.TicketHeader().unpack(file, pos)
         pos += len(self.hdr)
-        self.titleiv = struct.pack(">Q", self.hdr.titleid) + b"\x00" * 8
 
-        # Certificates
+        # Title IV, computed on demand and kept until the Title ID changes
+        self._titleiv = None
+        self._titleiv_titleid = None
+
+        # Issuer chain, split on demand and kept until the issuer is replaced
+        self._issuers = None
+        self._issuers_issuer = None
+
+        # Common Key, resolved on demand and kept until the Title ID prefix or common key index changes
+        self._decryption_key = None
+        self._decryption_key_sig = None
+
+        # Decrypted title key, kept until the title key, Title ID or common key index changes
+        self._decrypted_titlekey = None
+        self._decrypted_titlekey_sig = None
+
+        # Certificates, indexed by name on the first lookup
         self.certificates = []
-        if file[pos:]:
+        self._cert_index = {}
+        self._cert_index_certs = None
+        if len(file) > pos:
             self.certificates.append(Certificate(file[pos:]))
             pos += len(self.certificates[0])
             self.certificates.append(Certificate(file[pos:]))
@@ -703,15 +779,66 @@ class Ticket:
             if len(self.certificates) != 2:
                 raise Exception("Could not locate all Certs!")
 
-        # Decrypt title key
-        self.decrypted_titlekey = utils.Crypto.decrypt_titlekey(
-            commonkey=self.get_decryption_key(),
-            iv=self.titleiv,
-            titlekey=self.hdr.titlekey
-        )
+    @classmethod
+    def parse_many(cls, data, count=None):
+        """Returns a list of Tickets parsed from back-to-back tickets WITHOUT certificates
+           (e.g. a NAND .tik file holding several tickets).
+
+        Args:
+            data (bytes): Concatenated tickets
+            count (int): Maximum number of tickets to parse (Default: all)
+        """
+        data = memoryview(data)
+        tickets = []
+        pos = 0
+        while pos < len(data) and (count is None or len(tickets) < count):
+            size = 0x04 + utils.get_sig_size(data[pos:pos + 4]) + _TICKET_HEADER.size
+            tickets.append(cls(data[pos:pos + size]))
+            pos += size
+        return tickets
+
+    @property
+    def titleiv(self):
+        return self.get_iv()
+
+    @property
+    def decrypted_titlekey(self):
+        return self.get_decrypted_titlekey()
+
+    def get_iv(self):
+        """Returns the Title IV (Title ID followed by eight zero bytes)."""
+        if self._titleiv_titleid != self.hdr.titleid:
+            self._titleiv = self.hdr.titleid.to_bytes(8, byteorder="big") + b"\x00" * 8
+            self._titleiv_titleid = self.hdr.titleid
+        return self._titleiv
+
+    def get_decrypted_titlekey(self):
+        """Returns the title key decrypted with the Common Key."""
+        titlekey_sig = (self.hdr.titlekey, self.hdr.titleid, self.hdr.ckeyindex)
+        if self._decrypted_titlekey_sig != titlekey_sig:
+            self._decrypted_titlekey = utils.Crypto.decrypt_titlekey(
+                commonkey=self.get_decryption_key(),
+                iv=self.get_iv(),
+                titlekey=self.hdr.titlekey
+            )
+            self._decrypted_titlekey_sig = titlekey_sig
+        return self._decrypted_titlekey
+
+    def set_titlekey(self, key, encrypted=True):
+        """Sets the title key from a hex string. Decrypted keys are encrypted with the Common Key first.
+           Set the Title ID and common key index before passing a decrypted key.
+        """
+        titlekey = bytes.fromhex(key)
+        if not encrypted:
+            titlekey = utils.Crypto.encrypt_titlekey(
+                commonkey=self.get_decryption_key(),
+                iv=self.get_iv(),
+                titlekey=titlekey
+            )
+        self.hdr.titlekey = titlekey
 
     def get_titleid(self):
-        return "{:08X}".format(self.hdr.titleid).zfill(16).lower()
+        return "{:016x}".format(self.hdr.titleid)
 
     def get_issuer(self):
         """Returns list with the certificate chain issuers.
@@ -719,12 +846,23 @@ class Ticket:
            the one before that (CA) signs the CP cert and
            the first one (Root) signs the CA cert.
         """
-        return self.hdr.issuer.rstrip(b"\00").decode().split("-")
+        if self._issuers_issuer is not self.hdr.issuer:
+            self._issuers = self.hdr.issuer.rstrip(b"\00").decode().split("-")
+            self._issuers_issuer = self.hdr.issuer
+        return self._issuers
 
     def get_decryption_key(self):
-        # TODO: Debug (RVT) Tickets
         """Returns the appropiate Common Key"""
-        if self.get_titleid().startswith("00030"):
+        # Only the Title ID prefix (DSi or not) and the common key index select the key
+        key_sig = (self.hdr.titleid & _DSI_MASK, self.hdr.ckeyindex)
+        if self._decryption_key_sig != key_sig:
+            self._decryption_key = self._find_decryption_key()
+            self._decryption_key_sig = key_sig
+        return self._decryption_key
+
+    def _find_decryption_key(self):
+        # TODO: Debug (RVT) Tickets
+        if (self.hdr.titleid & _DSI_MASK) == _DSI_PREFIX:
             return DSI_KEY
         try:
             return DECRYPTION_KEYS[self.hdr.ckeyindex]
@@ -733,7 +871,7 @@ class Ticket:
             return DECRYPTION_KEYS[0]
 
     def get_common_key_type(self):
-        if self.get_titleid().startswith("00030"):
+        if (self.hdr.titleid & _DSI_MASK) == _DSI_PREFIX:
             return "DSi"
         key_types = [
             "Normal",
@@ -747,9 +885,13 @@ class Ticket:
 
     def get_cert_by_name(self, name):
         """Returns certificate by name."""
-        for i, cert in enumerate(self.certificates):
-            if cert.get_name() == name:
-                return i
+        if self._cert_index_certs != self.certificates:  # Certificates were added or replaced
+            self._cert_index = {}
+            for i, cert in enumerate(self.certificates):
+                self._cert_index.setdefault(cert.get_name(), i)
+            self._cert_index_certs = list(self.certificates)
+        if name in self._cert_index:
+            return self._cert_index[name]
         if name == "Root":
             if ROOT_KEY:
                 return ROOT_KEY
@@ -763,19 +905,11 @@ class Ticket:
         sigsize = len(self.signature.signature.data)
         self.signature.signature.data = b"\x00" * sigsize
 
-        # Modify content until SHA1 hash starts with 00
-        for i in range(65535):  # Max value for unsigned short integer (2 bytes)
-            # Modify ticket padding
-            self.hdr.padding = i
-
-            # Calculate hash
-            sha1hash = utils.Crypto.create_sha1hash_hex(self.signature_pack())
-
-            # Found valid hash!
-            if sha1hash.startswith("00"):
-                return
-
-        raise Exception("Fakesigning failed.")
+        # Modify ticket padding until SHA1 hash starts with 00
+        padding = _fakesign_search(bytearray(self.signature_pack()), _TICKET_PADDING_OFFSET)
+        if padding is None:
+            raise Exception("Fakesigning failed.")
+        self.hdr.padding = padding
 
     def pack(self):
         """Returns ticket WITHOUT certificates"""
@@ -792,9 +926,7 @@ class Ticket:
         """
         if output:
             output = output.format(titleid=self.get_titleid(), titleversion=self.hdr.titleversion)
-        pack = self.pack()
-        for cert in self.certificates:
-            pack += cert.pack()
+        pack = b"".join([self.signature.pack(), self.hdr.pack()] + [cert.pack() for cert in self.certificates])
         if output:
             with open(output, "wb") as cetk_file:
                 cetk_file.write(pack)
@@ -817,9 +949,9 @@ class Ticket:
             output += "  Console ID: {0}\n".format(self.hdr.consoleid)
         output += "\n"
         output += "  Common Key: {0}\n".format(self.get_common_key_type())
-        output += "  Initialization vector: {0}\n".format(binascii.hexlify(self.titleiv).decode())
-        output += "  Title key (encrypted): {0}\n".format(binascii.hexlify(self.hdr.titlekey).decode())
-        output += "  Title key (decrypted): {0}\n".format(binascii.hexlify(self.decrypted_titlekey).decode())
+        output += "  Initialization vector: {0}\n".format(self.get_iv().hex())
+        output += "  Title key (encrypted): {0}\n".format(self.hdr.titlekey.hex())
+        output += "  Title key (decrypted): {0}\n".format(self.get_decrypted_titlekey().hex())
 
         # TODO: Improve this, is a bit complicated to understand and duplicated
         if self.certificates:
@@ -1250,7 +1382,7 @@ class WADMaker:
         """Dumps WAD to output. Replaces {titleid} and {titleversion} if in filename.
            Passing "fixup=True"  will repair the common-key index and the certificate chain
         """
-        if self.ticket.get_titleid().startswith("00030"):
+        if (self.ticket.hdr.titleid & _DSI_MASK) == _DSI_PREFIX:
             raise Exception("Can't pack DSi Title as WAD.")
 
         output = output.format(titleid=self.tmd.get_titleid(), titleversion=self.tmd.hdr.titleversion)
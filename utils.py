@@ -15,6 +15,7 @@ except (ImportError, SyntaxError):
 class Crypto:
     """"This is a Cryptographic/hash class used to abstract away things."""
     blocksize = 64
+    titlekey_ciphers = {}
 
     @classmethod
     def decrypt_data(cls, key, iv, data, align_data=True):
@@ -34,10 +35,34 @@ class Crypto:
         else:
             return AES.new(key, AES.MODE_CBC, iv).encrypt(data)
 
+    @classmethod
+    def get_titlekey_cipher(cls, commonkey):
+        """Returns an AES-ECB cipher for the common key, set up only once per key."""
+        try:
+            return cls.titlekey_ciphers[commonkey]
+        except KeyError:
+            cipher = cls.titlekey_ciphers[commonkey] = AES.new(key=commonkey, mode=AES.MODE_ECB)
+            return cipher
+
     @classmethod
     def decrypt_titlekey(cls, commonkey, iv, titlekey):
         """Decrypts title key from the ticket."""
-        return AES.new(key=commonkey, mode=AES.MODE_CBC, iv=iv).decrypt(titlekey)
+        if len(titlekey) != AES.block_size:
+            return AES.new(key=commonkey, mode=AES.MODE_CBC, iv=iv).decrypt(titlekey)
+        # CBC over a single block is the ECB-decrypted block XORed with the IV
+        block = cls.get_titlekey_cipher(commonkey).decrypt(titlekey)
+        return (int.from_bytes(block, byteorder="big") ^ int.from_bytes(iv, byteorder="big")).to_bytes(
+            AES.block_size, byteorder="big")
+
+    @classmethod
+    def encrypt_titlekey(cls, commonkey, iv, titlekey):
+        """Encrypts title key for the ticket."""
+        if len(titlekey) != AES.block_size:
+            return AES.new(key=commonkey, mode=AES.MODE_CBC, iv=iv).encrypt(titlekey)
+        # CBC over a single block is the block XORed with the IV, then ECB-encrypted
+        block = (int.from_bytes(titlekey, byteorder="big") ^ int.from_bytes(iv, byteorder="big")).to_bytes(
+            AES.block_size, byteorder="big")
+        return cls.get_titlekey_cipher(commonkey).encrypt(block)
 
     @classmethod
     def verify_signature(cls, cert, data_to_verify, signature):